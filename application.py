@@ -19,175 +19,13 @@ NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FO
 OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
-import json
 import os
 
 import flask
-import pg8000
 
 import model
+import server
 import telemetry
-import util
-
-
-def create_app(app, records_keep, reporter):
-    """Create a new exemplar exploration application.
-
-    Args:
-        app: The flask.Flask application into which endpoints should be registered.
-        records_keep: The records to be served by this application.
-        reporter: Optional telemetry.UsageReporter with with to report usage information. If None,
-            telemetry is not reported.
-    Return:
-        The flask.Flask applicatino after registering endpoints.
-    """
-
-    def report_maybe(page, query):
-        """Report telemetry if reporter is given.
-
-        Args:
-            page: String page name.
-            query: String query or empty string if not applicable.
-        """
-        if reporter == None:
-            return
-
-        ip_address = flask.request.remote_addr
-        user_agent = flask.request.headers.get('User-Agent')
-        reporter.report_usage(ip_address, user_agent, page, query)
-
-    @app.route('/')
-    def home():
-        """Render the homepage.
-
-        Returns:
-            String rendered app page.
-        """
-        report_maybe('home', '')
-        return flask.render_template('app.html', page='app')
-
-    @app.route('/code')
-    def code():
-        """Render the page about code.
-
-        Returns:
-            String rendered code page.
-        """
-        report_maybe('code', '')
-        return flask.render_template('code.html', page='code')
-
-    @app.route('/data')
-    def data():
-        """Render the page about data.
-
-        Returns:
-            String rendered data page.
-        """
-        report_maybe('data', '')
-        return flask.render_template('data.html', page='data')
-
-    @app.route('/download')
-    def download():
-        """Redirect to the download.
-
-        Returns:
-            Redirect to the sqlite download.
-        """
-        report_maybe('download', '')
-        return flask.redirect('/static/zip/who_wrote_this_data.zip')
-
-    @app.route('/privacy')
-    def privacy():
-        """Render the page about privacy.
-
-        Returns:
-            String rendered data page.
-        """
-        report_maybe('privacy', '')
-        return flask.render_template('privacy.html', page='privacy')
-
-    @app.route('/terms')
-    def terms():
-        """Render the page about terms.
-
-        Returns:
-            String rendered data page.
-        """
-        report_maybe('terms', '')
-        return flask.render_template('terms.html', page='terms')
-
-    @app.route('/paper')
-    def paper():
-        """Render the page about the paper.
-
-        Returns:
-            String rendered paper page.
-        """
-        report_maybe('paper', '')
-        return flask.render_template('paper.html', page='paper')
-
-    @app.route('/prototypical.json')
-    def get_prototypical():
-        """Query for the prototypical articles across all topics.
-
-        Returns:
-            JSON listing of prototypical records.
-        """
-        report_maybe('prototypical', '')
-        records = records_keep.get_prototypical()
-        records_serial = list(sorted(
-            map(model.serialize_record_to_dict, records),
-            key=lambda x: x['source']
-        ))
-        return json.dumps({'records': records_serial})
-
-    @app.route('/query.json')
-    def query():
-        """Query for prototypical articles within a topic (using "search" url param).
-
-        Returns:
-            JSON listing of prototypical records for the given topic.
-        """
-        query_string = flask.request.args.get('search')
-        keywords = util.get_words(query_string)
-        report_maybe('query', query_string)
-        records = records_keep.query(keywords)
-        records_serial = list(sorted(
-            map(model.serialize_record_to_dict, records),
-            key=lambda x: x['source']
-        ))
-        return json.dumps({'records': records_serial})
-
-    return app
-
-
-def create_connection_generator(db_url, username, password, db_name, db_port):
-    """Create a new closure over the given parameters to generate postgres connections.
-
-    Args:
-        db_url: The string hostname of the database.
-        password: The string password of the database.
-        db_name: The database name.
-        db_port: The string or integer db port.
-    Returns:
-        Function which, taking no paramters, will return a new database connection.
-    """
-    def connect():
-        """Inner closure.
-
-        Returns:
-            New DB API v2 compliant connection.
-        """
-        return pg8000.connect(
-            host=db_url,
-            user=username,
-            password=password,
-            port=int(db_port),
-            database=db_name,
-            ssl=True
-        )
-
-    return connect
 
 
 def create_default_app():
@@ -205,20 +43,53 @@ def create_default_app():
         password = os.environ['TELEMETRY_DB_PASSWORD']
         db_name = os.environ['TELEMETRY_DB_NAME']
         db_port = os.environ['TELEMETRY_DB_PORT']
-        connection_generator = create_connection_generator(
+        db_timeout = float(os.environ.get('TELEMETRY_DB_TIMEOUT', '10'))
+        spool_dir = os.environ.get('TELEMETRY_SPOOL_DIR', None)
+        connection_generator = server.create_connection_generator(
             db_url,
             username,
             password,
             db_name,
-            db_port
+            db_port,
+            timeout=db_timeout
         )
 
-        connection = connection_generator()
-        connection.close()
+        if spool_dir == None:
+            connection = connection_generator()
+            connection.close()
+
+        reporter = telemetry.UsageReporter(
+            connection_generator,
+            spool_dir=spool_dir,
+            aggregate=os.environ.get('TELEMETRY_AGGREGATE', '') == 'true',
+            raw_sample_rate=float(os.environ.get('TELEMETRY_RAW_SAMPLE_RATE', '0'))
+        )
 
-        reporter = telemetry.UsageReporter(connection_generator)
+    keep_registry = None
+    if 'DATASETS_CONFIG_PATH' in os.environ:
+        budget_mb = int(os.environ.get('DATASETS_MEMORY_BUDGET_MB', '1024'))
+        if 'DEFAULT_KEEP_MEMORY_MB' in os.environ:
+            default_keep_bytes = int(os.environ['DEFAULT_KEEP_MEMORY_MB']) * 1024 * 1024
+        else:
+            default_keep_bytes = model.estimate_keep_bytes('predictions.csv')
+        keep_registry = model.load_registry_from_config(
+            os.environ['DATASETS_CONFIG_PATH'],
+            max(budget_mb * 1024 * 1024 - default_keep_bytes, 0)
+        )
 
-    app = create_app(flask.Flask(__name__), records_keep, reporter)
+    if 'WARM_UP_QUERIES_PATH' in os.environ:
+        warm_up_queries = server.load_warm_up_queries(os.environ['WARM_UP_QUERIES_PATH'])
+    else:
+        warm_up_queries = []
+
+    app = server.create_app(
+        flask.Flask(__name__),
+        records_keep,
+        reporter,
+        warm_up_queries=warm_up_queries,
+        warm_up_in_background=True,
+        keep_registry=keep_registry
+    )
     return app
 
 
@@ -0,0 +1,396 @@
+"""Load generator which drives the application with telemetry written to a local SQLite database.
+
+Usage: $ python load_generator.py --rps 200 --clients 16 --duration 30
+
+----
+
+Copyright 2019 Data Driven Empathy LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES
+OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import argparse
+import csv
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import flask
+
+import server
+import model
+import telemetry
+import util
+
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/76.0',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_6) AppleWebKit/605.1.15 (KHTML, like Gecko)',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 12_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko)',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:68.0) Gecko/20100101 Firefox/68.0'
+]
+
+PAGE_WEIGHTS = [
+    ('/query.json', 0.7),
+    ('/', 0.1),
+    ('/prototypical.json', 0.1),
+    ('/stats.json', 0.1)
+]
+
+
+def create_db(path):
+    """Create the telemetry tables in a new SQLite database.
+
+    Args:
+        path: The path at which the database should be created.
+    """
+    db_connection = sqlite3.connect(path)
+    cursor = db_connection.cursor()
+    cursor.execute('''
+        CREATE TABLE actions (
+            ipAddressHash TEXT,
+            userAgent TEXT,
+            page TEXT,
+            query TEXT,
+            timestampStr TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE actionRollups (
+            minuteStr TEXT,
+            ipAddressHash TEXT,
+            page TEXT,
+            query TEXT,
+            actionCount INTEGER
+        )
+    ''')
+    db_connection.commit()
+    db_connection.close()
+
+
+def count_written(path):
+    """Count the actions recorded in the telemetry database.
+
+    Args:
+        path: The path to the SQLite database.
+    Returns:
+        Tuple of (raw action rows, actions counted in rollups).
+    """
+    db_connection = sqlite3.connect(path)
+    cursor = db_connection.cursor()
+    cursor.execute('SELECT COUNT(*) FROM actions')
+    raw_count = cursor.fetchone()[0]
+    cursor.execute('SELECT COALESCE(SUM(actionCount), 0) FROM actionRollups')
+    rollup_count = cursor.fetchone()[0]
+    db_connection.close()
+    return (raw_count, rollup_count)
+
+
+def synthesize_queries(record_dicts, num_queries, rng):
+    """Create queries of one or two words taken from article titles so that each has results.
+
+    Args:
+        record_dicts: List of dictionaries describing articles.
+        num_queries: The number of queries to create.
+        rng: The random.Random to use.
+    Returns:
+        List of string queries which is empty if no title has words.
+    """
+    titles = [util.get_words(x['title'], dedupe=False) for x in record_dicts]
+    titles = [x for x in titles if x]
+
+    if not titles:
+        return []
+
+    queries = []
+    for i in range(num_queries):
+        words = rng.choice(titles)
+        num_words = min(len(words), rng.randint(1, 2))
+        queries.append(' '.join(rng.sample(words, num_words)))
+
+    return queries
+
+
+def build_request_log(queries, num_requests, rng):
+    """Create the sequence of requests to be sent.
+
+    Args:
+        queries: List of string queries from which query requests should be drawn.
+        num_requests: The number of requests to create.
+        rng: The random.Random to use.
+    Returns:
+        List of tuples of (url, ip_address, user_agent).
+    """
+    pages = [x[0] for x in PAGE_WEIGHTS]
+    weights = [x[1] for x in PAGE_WEIGHTS]
+
+    requests = []
+    for i in range(num_requests):
+        page = rng.choices(pages, weights=weights)[0]
+        if page in ('/query.json', '/stats.json'):
+            url = page + '?' + urllib.parse.urlencode({'search': rng.choice(queries)})
+        else:
+            url = page
+
+        ip_address = '10.0.%d.%d' % (rng.randint(0, 255), rng.randint(1, 254))
+        requests.append((url, ip_address, rng.choice(USER_AGENTS)))
+
+    return requests
+
+
+def run_clients(app, requests, rps, num_clients):
+    """Send requests from concurrent clients at a target rate.
+
+    Requests are scheduled at fixed intervals from the start of the run regardless of how long
+    earlier requests took so that a slow application builds a backlog instead of lowering the rate.
+
+    Args:
+        app: The flask.Flask application to exercise.
+        requests: List of tuples of (url, ip_address, user_agent).
+        rps: Target requests per second across all clients.
+        num_clients: Number of concurrent client threads.
+    Returns:
+        Tuple of (list of float latencies in seconds, integer count of error responses).
+    """
+    latencies = []
+    errors = {'count': 0}
+    next_index = {'index': 0}
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def run_client():
+        """Inner closure running a single client until all requests are sent."""
+        client = app.test_client()
+
+        while True:
+            with lock:
+                index = next_index['index']
+                next_index['index'] += 1
+
+            if index >= len(requests):
+                return
+
+            wait = start + index / rps - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+
+            (url, ip_address, user_agent) = requests[index]
+            request_start = time.perf_counter()
+            response = client.get(
+                url,
+                headers={'User-Agent': user_agent},
+                environ_base={'REMOTE_ADDR': ip_address}
+            )
+            latency = time.perf_counter() - request_start
+
+            with lock:
+                latencies.append(latency)
+                if response.status_code >= 400:
+                    errors['count'] += 1
+
+    threads = [threading.Thread(target=run_client) for i in range(num_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return (latencies, errors['count'])
+
+
+def sample_queue_depth(reporter, interval, stop_event):
+    """Sample the depth of the telemetry queue until stopped.
+
+    Args:
+        reporter: The telemetry.UsageReporter to observe.
+        interval: Seconds between samples.
+        stop_event: threading.Event which ends sampling when set.
+    Returns:
+        List of tuples of (seconds since start, queue depth), filled in as samples are taken.
+    """
+    samples = []
+    start = time.perf_counter()
+
+    def run_sampler():
+        """Inner closure taking samples."""
+        while not stop_event.is_set():
+            samples.append((time.perf_counter() - start, reporter.get_queue_depth()))
+            stop_event.wait(interval)
+
+    threading.Thread(target=run_sampler, daemon=True).start()
+    return samples
+
+
+def get_percentile(sorted_values, fraction):
+    """Get a percentile from sorted values using the nearest rank.
+
+    Args:
+        sorted_values: Non-empty list of values in ascending order.
+        fraction: The percentile from 0 to 1.
+    Returns:
+        The value at the requested percentile.
+    """
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def format_report(latencies, elapsed, target_rps, num_errors, depth_samples, dropped, written,
+        worker_stats):
+    """Describe the results of a load test.
+
+    Args:
+        latencies: List of float latencies in seconds, one per response.
+        elapsed: Seconds taken to send all requests.
+        target_rps: The requests per second requested.
+        num_errors: Count of error responses.
+        depth_samples: List of tuples of (seconds since start, queue depth).
+        dropped: Count of telemetry events dropped by the ring.
+        written: Tuple of (raw action rows, actions counted in rollups) in the database.
+        worker_stats: Dictionary of unwritten row counts from UsageReporter.get_worker_stats.
+    Returns:
+        String report with one result per line.
+    """
+    lines = []
+
+    latencies = sorted(latencies)
+    lines.append('requests: %d in %.2f s (%.1f rps, target %.1f)' % (
+        len(latencies),
+        elapsed,
+        len(latencies) / elapsed if elapsed > 0 else 0,
+        target_rps
+    ))
+    lines.append('errors: %d' % num_errors)
+
+    if latencies:
+        lines.append('latency ms: p50 %.2f, p90 %.2f, p99 %.2f, max %.2f' % (
+            get_percentile(latencies, 0.5) * 1000,
+            get_percentile(latencies, 0.9) * 1000,
+            get_percentile(latencies, 0.99) * 1000,
+            latencies[-1] * 1000
+        ))
+    else:
+        lines.append('latency ms: no responses')
+
+    lines.append('queue depth (max per second):')
+    max_by_second = {}
+    for (offset, depth) in depth_samples:
+        second = int(offset)
+        max_by_second[second] = max(max_by_second.get(second, 0), depth)
+    for second in sorted(max_by_second.keys()):
+        lines.append('  %4d s: %d' % (second, max_by_second[second]))
+
+    (raw_written, rollup_written) = written
+    lines.append('telemetry events: %d reported, %d dropped, %d raw rows written, %d in rollups' % (
+        len(latencies),
+        dropped,
+        raw_written,
+        rollup_written
+    ))
+    lines.append(
+        'telemetry rows unwritten: %d in spool, %d dropped by cap, %d corrupt, %d discarded' % (
+            worker_stats['spoolPendingRows'],
+            worker_stats['spoolDroppedRows'],
+            worker_stats['spoolCorruptRows'],
+            worker_stats['discardedRows']
+        )
+    )
+
+    return '\n'.join(lines)
+
+
+def main():
+    """Run the load test and print a report."""
+    parser = argparse.ArgumentParser(description='Drive the application with synthetic traffic.')
+    parser.add_argument('--records', default='predictions.csv', help='CSV of predictions to serve.')
+    parser.add_argument('--queries', help='Optional file of recorded queries, one per line.')
+    parser.add_argument('--rps', type=float, default=100, help='Target requests per second.')
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent clients.')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds of traffic to send.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for synthesized traffic.')
+    parser.add_argument('--ring-capacity', type=int, default=4096, help='Telemetry ring size.')
+    parser.add_argument('--aggregate', action='store_true', help='Write telemetry rollups.')
+    args = parser.parse_args()
+
+    if args.rps <= 0 or args.duration <= 0 or args.rps * args.duration < 1:
+        parser.error('--rps and --duration must be positive and send at least one request')
+
+    if args.clients < 1:
+        parser.error('--clients must be at least 1')
+
+    rng = random.Random(args.seed)
+
+    with open(args.records, 'r', encoding='utf-8-sig') as f:
+        record_dicts = list(csv.DictReader(f))
+    records_keep = model.load_keep_from_dicts(record_dicts)
+
+    if args.queries:
+        queries = server.load_warm_up_queries(args.queries)
+    else:
+        queries = synthesize_queries(record_dicts, 1000, rng)
+
+    if not queries:
+        parser.error('no queries could be read or synthesized from the records')
+
+    requests = build_request_log(queries, int(args.rps * args.duration), rng)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'telemetry.db')
+        create_db(db_path)
+
+        reporter = telemetry.UsageReporter(
+            lambda: sqlite3.connect(db_path),
+            min_wait=10,
+            max_wait=100,
+            use_question_mark=True,
+            spool_dir=os.path.join(temp_dir, 'spool'),
+            ring_capacity=args.ring_capacity,
+            aggregate=args.aggregate
+        )
+
+        app = server.create_app(
+            flask.Flask(server.__name__),
+            records_keep,
+            reporter
+        )
+
+        stop_event = threading.Event()
+        depth_samples = sample_queue_depth(reporter, 0.1, stop_event)
+
+        start = time.perf_counter()
+        (latencies, num_errors) = run_clients(app, requests, args.rps, args.clients)
+        elapsed = time.perf_counter() - start
+
+        dropped = reporter.get_dropped_count()
+        reporter.terminate()
+        worker_stats = reporter.get_worker_stats()
+        stop_event.set()
+
+        (raw_written, rollup_written) = count_written(db_path)
+
+    print(format_report(
+        latencies,
+        elapsed,
+        args.rps,
+        num_errors,
+        depth_samples,
+        dropped,
+        (raw_written, rollup_written),
+        worker_stats
+    ))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Copyright 2019 Data Driven Empathy LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES
+OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import random
+import unittest
+import urllib.parse
+
+import load_generator
+
+
+class LoadGeneratorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.__record_dicts = [
+            {'title': 'climate change report', 'link': '', 'actualSource': 'NPR', 'score': '0.75'},
+            {'title': '...', 'link': '', 'actualSource': 'CNN', 'score': '0.5'},
+            {'title': 'election', 'link': '', 'actualSource': 'CNN', 'score': '0.25'}
+        ]
+
+    def test_synthesize_queries(self):
+        queries = load_generator.synthesize_queries(self.__record_dicts, 50, random.Random(0))
+        self.assertEquals(len(queries), 50)
+
+        title_words = {'climate', 'change', 'report', 'election'}
+        for query in queries:
+            words = query.split(' ')
+            self.assertTrue(1 <= len(words) <= 2)
+            self.assertTrue(set(words).issubset(title_words))
+
+    def test_synthesize_queries_deterministic(self):
+        queries_1 = load_generator.synthesize_queries(self.__record_dicts, 20, random.Random(1))
+        queries_2 = load_generator.synthesize_queries(self.__record_dicts, 20, random.Random(1))
+        self.assertEquals(queries_1, queries_2)
+
+    def test_synthesize_queries_no_words(self):
+        record_dicts = [{'title': '...', 'link': '', 'actualSource': 'CNN', 'score': '0.5'}]
+        queries = load_generator.synthesize_queries(record_dicts, 10, random.Random(0))
+        self.assertEquals(queries, [])
+
+    def test_build_request_log(self):
+        requests = load_generator.build_request_log(['climate', 'election'], 200, random.Random(0))
+        self.assertEquals(len(requests), 200)
+
+        pages = set(map(lambda x: x[0], load_generator.PAGE_WEIGHTS))
+        for (url, ip_address, user_agent) in requests:
+            parsed = urllib.parse.urlparse(url)
+            self.assertTrue(parsed.path in pages)
+            if parsed.path in ('/query.json', '/stats.json'):
+                search = urllib.parse.parse_qs(parsed.query)['search'][0]
+                self.assertTrue(search in ('climate', 'election'))
+            else:
+                self.assertEquals(parsed.query, '')
+            self.assertTrue(ip_address.startswith('10.0.'))
+            self.assertTrue(user_agent in load_generator.USER_AGENTS)
+
+    def test_get_percentile(self):
+        values = list(range(1, 101))
+        self.assertEquals(load_generator.get_percentile(values, 0), 1)
+        self.assertEquals(load_generator.get_percentile(values, 0.5), 51)
+        self.assertEquals(load_generator.get_percentile(values, 0.99), 100)
+        self.assertEquals(load_generator.get_percentile(values, 1), 100)
+
+    def test_get_percentile_single(self):
+        self.assertEquals(load_generator.get_percentile([3], 0.5), 3)
+        self.assertEquals(load_generator.get_percentile([3], 1), 3)
+
+    def test_format_report(self):
+        report = load_generator.format_report(
+            [0.003, 0.001, 0.002, 0.004],
+            2,
+            5,
+            1,
+            [(0.1, 2), (0.5, 7), (1.2, 3)],
+            0,
+            (3, 0),
+            {'spoolPendingRows': 1, 'spoolDroppedRows': 0, 'spoolCorruptRows': 0, 'discardedRows': 0}
+        )
+        lines = report.split('\n')
+        self.assertEquals(lines[0], 'requests: 4 in 2.00 s (2.0 rps, target 5.0)')
+        self.assertEquals(lines[1], 'errors: 1')
+        self.assertEquals(lines[2], 'latency ms: p50 3.00, p90 4.00, p99 4.00, max 4.00')
+        self.assertEquals(lines[4], '     0 s: 7')
+        self.assertEquals(lines[5], '     1 s: 3')
+        self.assertTrue('4 reported, 0 dropped, 3 raw rows written' in lines[6])
+        self.assertTrue('1 in spool' in lines[7])
+
+    def test_format_report_no_responses(self):
+        report = load_generator.format_report(
+            [],
+            0,
+            5,
+            0,
+            [],
+            0,
+            (0, 0),
+            {'spoolPendingRows': 0, 'spoolDroppedRows': 0, 'spoolCorruptRows': 0, 'discardedRows': 0}
+        )
+        self.assertTrue('latency ms: no responses' in report)
+        self.assertTrue('requests: 0 in 0.00 s (0.0 rps, target 5.0)' in report)
@@ -16,6 +16,10 @@ OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
 CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import json
+import os
+import tempfile
+import threading
 import unittest
 
 import model
@@ -59,3 +63,153 @@ class ModelTest(unittest.TestCase):
 
         self.assertEquals(prototypical_npr.get_title(), 'title 1 a')
         self.assertEquals(prototypical_cnn.get_title(), 'title 3 a')
+
+    def test_get_summaries(self):
+        summaries = self.__keep.get_summaries()
+        self.assertEquals(len(summaries), 2)
+
+        summary_npr = list(filter(lambda x: x.get_source() == 'NPR', summaries))[0]
+        self.assertEquals(summary_npr.get_count(), 2)
+        self.assertAlmostEqual(summary_npr.get_mean(), 0.625)
+        self.assertAlmostEqual(summary_npr.get_quantiles()[2], 0.625)
+        self.assertEquals(sum(summary_npr.get_histogram()), 2)
+        self.assertEquals(summary_npr.get_histogram()[-1], 1)
+
+    def test_query_summaries(self):
+        summaries = self.__keep.query_summaries(['b'])
+        self.assertEquals(len(summaries), 2)
+
+        summary_cnn = list(filter(lambda x: x.get_source() == 'CNN', summaries))[0]
+        self.assertEquals(summary_cnn.get_count(), 1)
+        self.assertAlmostEqual(summary_cnn.get_mean(), 0.1)
+        self.assertEquals(summary_cnn.get_histogram()[0], 1)
+
+    def test_get_bin_edges(self):
+        bin_edges = self.__keep.get_bin_edges()
+        self.assertEquals(len(bin_edges), 21)
+        self.assertAlmostEqual(bin_edges[0], 0.1)
+        self.assertAlmostEqual(bin_edges[-1], 0.75)
+
+
+class KeepRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.__loads = []
+
+        def loader(path):
+            self.__loads.append(path)
+            return model.ArticleKeep([model.ArticleRecord('title a', '', path, 0.5)])
+
+        self.__registry = model.KeepRegistry(
+            {'v1': 'v1.csv', 'v2': 'v2.csv', 'v3': 'v3.csv'},
+            2,
+            loader=loader,
+            size_estimator=lambda path: 1
+        )
+
+    def test_lazy_load(self):
+        self.assertEquals(len(self.__loads), 0)
+
+        keep = self.__registry.get('v1')
+        self.assertEquals(keep.get_prototypical()[0].get_source(), 'v1.csv')
+
+        self.__registry.get('v1')
+        self.assertEquals(self.__loads, ['v1.csv'])
+
+    def test_evict(self):
+        self.__registry.get('v1')
+        self.__registry.get('v2')
+        self.__registry.get('v1')
+        self.__registry.get('v3')
+
+        self.assertEquals(self.__registry.get_loaded_names(), ['v1', 'v3'])
+
+    def test_evict_before_load(self):
+        loaded_during_load = []
+
+        def loader(path):
+            loaded_during_load.append(registry.get_loaded_names())
+            return model.ArticleKeep([model.ArticleRecord('title a', '', path, 0.5)])
+
+        registry = model.KeepRegistry(
+            {'v1': 'v1.csv', 'v2': 'v2.csv'},
+            2,
+            loader=loader,
+            size_estimator=lambda path: 2
+        )
+
+        registry.get('v1')
+        registry.get('v2')
+        self.assertEquals(loaded_during_load, [[], []])
+        self.assertEquals(registry.get_loaded_names(), ['v2'])
+
+    def test_load_does_not_block_loaded(self):
+        loading = threading.Event()
+        release = threading.Event()
+
+        def slow_loader(path):
+            if path == 'v2.csv':
+                loading.set()
+                release.wait(5)
+            return model.ArticleKeep([model.ArticleRecord('title a', '', path, 0.5)])
+
+        registry = model.KeepRegistry(
+            {'v1': 'v1.csv', 'v2': 'v2.csv'},
+            10,
+            loader=slow_loader,
+            size_estimator=lambda path: 1
+        )
+        registry.get('v1')
+
+        thread = threading.Thread(target=lambda: registry.get('v2'))
+        thread.start()
+        loading.wait(5)
+
+        keep = registry.get('v1')
+        self.assertEquals(keep.get_prototypical()[0].get_source(), 'v1.csv')
+        self.assertTrue(thread.is_alive())
+
+        release.set()
+        thread.join()
+        self.assertEquals(registry.get_loaded_names(), ['v1', 'v2'])
+
+    def test_unknown(self):
+        self.assertFalse(self.__registry.has_dataset('v4'))
+        with self.assertRaises(KeyError):
+            self.__registry.get('v4')
+
+    def test_config_bytes(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for name in ['v1', 'v2']:
+                with open(os.path.join(temp_dir, name + '.csv'), 'w', encoding='utf-8') as f:
+                    f.write('title,link,actualSource,score\ntitle a,,NPR,0.5\n')
+
+            def load_registry(config):
+                config_path = os.path.join(temp_dir, 'datasets.json')
+                with open(config_path, 'w', encoding='utf-8') as f:
+                    json.dump(config, f)
+                registry = model.load_registry_from_config(config_path, 10000)
+                registry.get('v1')
+                registry.get('v2')
+                return registry
+
+            estimated = load_registry({
+                'v1': os.path.join(temp_dir, 'v1.csv'),
+                'v2': {'path': os.path.join(temp_dir, 'v2.csv')}
+            })
+            self.assertEquals(estimated.get_loaded_names(), ['v1', 'v2'])
+
+            configured = load_registry({
+                'v1': {'path': os.path.join(temp_dir, 'v1.csv'), 'bytes': 9900},
+                'v2': os.path.join(temp_dir, 'v2.csv')
+            })
+            self.assertEquals(configured.get_loaded_names(), ['v2'])
+
+    def test_config_invalid(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            config_path = os.path.join(temp_dir, 'datasets.json')
+            with open(config_path, 'w', encoding='utf-8') as f:
+                json.dump({'v1': {'bytes': 10}}, f)
+
+            with self.assertRaises(ValueError):
+                model.load_registry_from_config(config_path, 10000)
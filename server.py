@@ -0,0 +1,321 @@
+"""Endpoints and setup for the application without creating it on import.
+
+----
+
+Copyright 2019 Data Driven Empathy LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES
+OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import json
+import threading
+
+import flask
+import pg8000
+
+import model
+import util
+
+
+def serialize_records(records):
+    """Serialize article records into a JSON response body.
+
+    Args:
+        records: Iterable over ArticleRecords to be serialized.
+    Returns:
+        String JSON listing of records sorted by source.
+    """
+    records_serial = list(sorted(
+        map(model.serialize_record_to_dict, records),
+        key=lambda x: x['source']
+    ))
+    return json.dumps({'records': records_serial})
+
+
+def serialize_summaries(keep, summaries):
+    """Serialize score summaries into a JSON response body.
+
+    Args:
+        keep: The ArticleKeep from which the summaries were made, providing histogram bin edges.
+        summaries: Iterable over ScoreSummaries to be serialized.
+    Returns:
+        String JSON listing of summaries sorted by source along with histogram bin edges.
+    """
+    summaries_serial = list(sorted(
+        map(model.serialize_summary_to_dict, summaries),
+        key=lambda x: x['source']
+    ))
+    return json.dumps({'binEdges': keep.get_bin_edges(), 'sources': summaries_serial})
+
+
+def warm_up(app, records_keep, warm_up_queries):
+    """Exercise templates and queries so that the first requests do not pay for cold caches.
+
+    Args:
+        app: The flask.Flask application whose templates should be compiled.
+        records_keep: The records to be served by this application.
+        warm_up_queries: Iterable over string queries to run through the keep and serializers.
+    """
+    for template_name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(template_name)
+
+    serialize_records(records_keep.get_prototypical())
+    serialize_summaries(records_keep, records_keep.get_summaries())
+
+    for query_string in warm_up_queries:
+        keywords = util.get_words(query_string)
+        if keywords:
+            serialize_records(records_keep.query(keywords))
+            serialize_summaries(records_keep, records_keep.query_summaries(keywords))
+
+
+def load_warm_up_queries(path):
+    """Load queries to be used in warm up from a file with one query per line.
+
+    Args:
+        path: The path to the local text file.
+    Returns:
+        List of string queries. Blank lines are ignored.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() != '']
+
+
+def create_app(app, records_keep, reporter, warm_up_queries=(), warm_up_in_background=False,
+        keep_registry=None):
+    """Create a new exemplar exploration application.
+
+    Args:
+        app: The flask.Flask application into which endpoints should be registered.
+        records_keep: The records to be served by this application.
+        reporter: Optional telemetry.UsageReporter with with to report usage information. If None,
+            telemetry is not reported.
+        warm_up_queries: Iterable over string queries to run before reporting ready.
+        warm_up_in_background: Flag indicating if warm up should run in a background thread. If
+            true, this returns immediately and /ready reports unavailable until warm up finishes or
+            indefinitely if it fails. If false, warm up finishes (or raises) before this returns.
+        keep_registry: Optional model.KeepRegistry of additional datasets which may be selected
+            through the "dataset" url param. If None, only records_keep is served.
+    Return:
+        The flask.Flask applicatino after registering endpoints.
+    """
+    readiness = {'ready': False, 'failed': False}
+
+    def report_maybe(page, query):
+        """Report telemetry if reporter is given.
+
+        Args:
+            page: String page name.
+            query: String query or empty string if not applicable.
+        """
+        if reporter == None:
+            return
+
+        ip_address = flask.request.remote_addr
+        user_agent = flask.request.headers.get('User-Agent')
+        reporter.report_usage(ip_address, user_agent, page, query)
+
+    def get_keep():
+        """Get the keep for the dataset requested through the "dataset" url param.
+
+        Returns:
+            records_keep if no dataset was requested or the ArticleKeep for the requested dataset.
+            Aborts with 404 if the dataset is not registered.
+        """
+        dataset = flask.request.args.get('dataset')
+        if dataset == None:
+            return records_keep
+
+        if keep_registry == None or not keep_registry.has_dataset(dataset):
+            flask.abort(404)
+
+        return keep_registry.get(dataset)
+
+    @app.route('/')
+    def home():
+        """Render the homepage.
+
+        Returns:
+            String rendered app page.
+        """
+        report_maybe('home', '')
+        return flask.render_template('app.html', page='app')
+
+    @app.route('/code')
+    def code():
+        """Render the page about code.
+
+        Returns:
+            String rendered code page.
+        """
+        report_maybe('code', '')
+        return flask.render_template('code.html', page='code')
+
+    @app.route('/data')
+    def data():
+        """Render the page about data.
+
+        Returns:
+            String rendered data page.
+        """
+        report_maybe('data', '')
+        return flask.render_template('data.html', page='data')
+
+    @app.route('/download')
+    def download():
+        """Redirect to the download.
+
+        Returns:
+            Redirect to the sqlite download.
+        """
+        report_maybe('download', '')
+        return flask.redirect('/static/zip/who_wrote_this_data.zip')
+
+    @app.route('/privacy')
+    def privacy():
+        """Render the page about privacy.
+
+        Returns:
+            String rendered data page.
+        """
+        report_maybe('privacy', '')
+        return flask.render_template('privacy.html', page='privacy')
+
+    @app.route('/terms')
+    def terms():
+        """Render the page about terms.
+
+        Returns:
+            String rendered data page.
+        """
+        report_maybe('terms', '')
+        return flask.render_template('terms.html', page='terms')
+
+    @app.route('/paper')
+    def paper():
+        """Render the page about the paper.
+
+        Returns:
+            String rendered paper page.
+        """
+        report_maybe('paper', '')
+        return flask.render_template('paper.html', page='paper')
+
+    @app.route('/prototypical.json')
+    def get_prototypical():
+        """Query for the prototypical articles across all topics.
+
+        Returns:
+            JSON listing of prototypical records.
+        """
+        report_maybe('prototypical', '')
+        records = get_keep().get_prototypical()
+        return serialize_records(records)
+
+    @app.route('/query.json')
+    def query():
+        """Query for prototypical articles within a topic (using "search" url param).
+
+        Returns:
+            JSON listing of prototypical records for the given topic.
+        """
+        query_string = flask.request.args.get('search')
+        keywords = util.get_words(query_string)
+        report_maybe('query', query_string)
+        records = get_keep().query(keywords)
+        return serialize_records(records)
+
+    @app.route('/stats.json')
+    def stats():
+        """Summarize score distributions per agency, optionally within a topic ("search" url param).
+
+        Returns:
+            JSON listing of score summaries per agency along with histogram bin edges.
+        """
+        query_string = flask.request.args.get('search', '')
+        keywords = util.get_words(query_string)
+        report_maybe('stats', query_string)
+
+        keep = get_keep()
+        if keywords:
+            summaries = keep.query_summaries(keywords)
+        else:
+            summaries = keep.get_summaries()
+
+        return serialize_summaries(keep, summaries)
+
+    @app.route('/ready')
+    def ready():
+        """Report if this worker has finished warming up.
+
+        Returns:
+            JSON readiness status with 200 if ready or 503 if still warming up or warm up failed.
+        """
+        if readiness['ready']:
+            return json.dumps({'ready': True})
+        else:
+            return json.dumps({'ready': False, 'failed': readiness['failed']}), 503
+
+    def run_warm_up():
+        """Warm up the application and then mark it ready."""
+        warm_up(app, records_keep, warm_up_queries)
+        readiness['ready'] = True
+
+    def run_warm_up_in_background():
+        """Warm up from a background thread, marking the worker failed if warm up raises."""
+        try:
+            run_warm_up()
+        except Exception:
+            app.logger.exception('Warm up failed so this worker will not report ready.')
+            readiness['failed'] = True
+
+    if warm_up_in_background:
+        threading.Thread(target=run_warm_up_in_background, daemon=True).start()
+    else:
+        run_warm_up()
+
+    return app
+
+
+def create_connection_generator(db_url, username, password, db_name, db_port, timeout=None):
+    """Create a new closure over the given parameters to generate postgres connections.
+
+    Args:
+        db_url: The string hostname of the database.
+        password: The string password of the database.
+        db_name: The database name.
+        db_port: The string or integer db port.
+        timeout: Optional socket timeout in seconds for connecting and for each operation on the
+            connection. If None, operations may block indefinitely.
+    Returns:
+        Function which, taking no paramters, will return a new database connection.
+    """
+    def connect():
+        """Inner closure.
+
+        Returns:
+            New DB API v2 compliant connection.
+        """
+        return pg8000.connect(
+            host=db_url,
+            user=username,
+            password=password,
+            port=int(db_port),
+            database=db_name,
+            ssl=True,
+            timeout=timeout
+        )
+
+    return connect
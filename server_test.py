@@ -0,0 +1,259 @@
+"""Copyright 2019 Data Driven Empathy LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES
+OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import flask
+
+import model
+import server
+
+
+def create_records():
+    """Create records for a small test keep.
+
+    Returns:
+        List of ArticleRecords from two agencies.
+    """
+    return [
+        model.ArticleRecord('title 1 a', '', 'NPR', 0.75),
+        model.ArticleRecord('title 2 b', '', 'NPR', 0.5),
+        model.ArticleRecord('title 3 a', '', 'CNN', 0.25),
+        model.ArticleRecord('title 4 b', '', 'CNN', 0.1)
+    ]
+
+
+def wait_for_ready_body(client, condition):
+    """Poll /ready until its JSON body satisfies a condition or a timeout passes.
+
+    Args:
+        client: The flask test client to use.
+        condition: Function taking the decoded body and returning true when done waiting.
+    Returns:
+        Tuple of (status code, decoded body) from the last response.
+    """
+    deadline = time.time() + 5
+    while True:
+        response = client.get('/ready')
+        body = json.loads(response.data)
+        if condition(body) or time.time() > deadline:
+            return (response.status_code, body)
+        time.sleep(0.01)
+
+
+class BlockingKeep(model.ArticleKeep):
+    """Keep whose warm up blocks until released."""
+
+    def __init__(self, records):
+        super().__init__(records)
+        self.release = threading.Event()
+
+    def get_prototypical(self):
+        self.release.wait(5)
+        return super().get_prototypical()
+
+
+class FailingKeep(model.ArticleKeep):
+    """Keep whose summaries cannot be computed."""
+
+    def get_summaries(self):
+        raise RuntimeError('summaries unavailable')
+
+
+class RecordingKeep(model.ArticleKeep):
+    """Keep which records the summary methods called on it."""
+
+    def __init__(self, records):
+        super().__init__(records)
+        self.calls = []
+
+    def get_summaries(self):
+        self.calls.append('get_summaries')
+        return super().get_summaries()
+
+    def query_summaries(self, keywords):
+        self.calls.append('query_summaries')
+        return super().query_summaries(keywords)
+
+
+class WarmUpTest(unittest.TestCase):
+
+    def test_ready_after_warm_up(self):
+        keep = BlockingKeep(create_records())
+        app = server.create_app(
+            flask.Flask(server.__name__),
+            keep,
+            None,
+            warm_up_in_background=True
+        )
+        client = app.test_client()
+
+        response = client.get('/ready')
+        self.assertEquals(response.status_code, 503)
+        self.assertEquals(json.loads(response.data), {'ready': False, 'failed': False})
+
+        keep.release.set()
+        (status_code, body) = wait_for_ready_body(client, lambda x: x['ready'])
+        self.assertEquals(status_code, 200)
+        self.assertEquals(body, {'ready': True})
+
+    def test_ready_after_failed_warm_up(self):
+        app = flask.Flask(server.__name__)
+        with self.assertLogs(app.logger, level='ERROR'):
+            server.create_app(
+                app,
+                FailingKeep(create_records()),
+                None,
+                warm_up_in_background=True
+            )
+            (status_code, body) = wait_for_ready_body(
+                app.test_client(),
+                lambda x: x.get('failed', False)
+            )
+
+        self.assertEquals(status_code, 503)
+        self.assertEquals(body, {'ready': False, 'failed': True})
+
+    def test_warm_up_summaries(self):
+        keep = RecordingKeep(create_records())
+        server.create_app(
+            flask.Flask(server.__name__),
+            keep,
+            None,
+            warm_up_queries=['a', '...']
+        )
+        self.assertEquals(keep.calls, ['get_summaries', 'query_summaries'])
+
+    def test_load_warm_up_queries(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'queries.txt')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('climate change\n\n   \n election \n')
+
+            queries = server.load_warm_up_queries(path)
+
+        self.assertEquals(queries, ['climate change', 'election'])
+
+
+class StatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.__keep = model.ArticleKeep(create_records())
+        app = server.create_app(flask.Flask(server.__name__), self.__keep, None)
+        self.__client = app.test_client()
+
+    def get_stats(self, url):
+        response = self.__client.get(url)
+        self.assertEquals(response.status_code, 200)
+        return json.loads(response.data)
+
+    def test_stats_global(self):
+        stats = self.get_stats('/stats.json')
+        self.assertEquals(stats['binEdges'], self.__keep.get_bin_edges())
+        self.assertEquals([x['source'] for x in stats['sources']], ['CNN', 'NPR'])
+
+        stats_npr = stats['sources'][1]
+        self.assertEquals(stats_npr['count'], 2)
+        self.assertAlmostEqual(stats_npr['mean'], 0.625)
+        self.assertEquals(sum(stats_npr['histogram']), 2)
+        self.assertEquals(len(stats_npr['histogram']), len(stats['binEdges']) - 1)
+
+    def test_stats_search(self):
+        stats = self.get_stats('/stats.json?search=b')
+        self.assertEquals([x['source'] for x in stats['sources']], ['CNN', 'NPR'])
+        self.assertEquals([x['count'] for x in stats['sources']], [1, 1])
+        self.assertAlmostEqual(stats['sources'][0]['mean'], 0.1)
+        self.assertAlmostEqual(stats['sources'][1]['mean'], 0.5)
+
+    def test_stats_search_no_results(self):
+        stats = self.get_stats('/stats.json?search=missing')
+        self.assertEquals(stats['sources'], [])
+
+    def test_stats_empty_search(self):
+        stats_global = self.get_stats('/stats.json')
+        self.assertEquals(self.get_stats('/stats.json?search='), stats_global)
+        self.assertEquals(self.get_stats('/stats.json?search=...'), stats_global)
+
+
+class DatasetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.__loaded_paths = []
+
+        def load_keep(path):
+            self.__loaded_paths.append(path)
+            return model.ArticleKeep([
+                model.ArticleRecord('title 5 a', '', 'Fox', 0.9),
+                model.ArticleRecord('title 6 b', '', 'Fox', 0.3)
+            ])
+
+        keep_registry = model.KeepRegistry(
+            {'v2': 'predictions_v2.csv'},
+            1000,
+            loader=load_keep,
+            size_estimator=lambda x: 100
+        )
+        app = server.create_app(
+            flask.Flask(server.__name__),
+            model.ArticleKeep(create_records()),
+            None,
+            keep_registry=keep_registry
+        )
+        self.__client = app.test_client()
+
+    def get_sources(self, url):
+        response = self.__client.get(url)
+        self.assertEquals(response.status_code, 200)
+        return set(x['source'] for x in json.loads(response.data)['records'])
+
+    def test_default_dataset(self):
+        self.assertEquals(self.get_sources('/prototypical.json'), {'CNN', 'NPR'})
+        self.assertEquals(self.__loaded_paths, [])
+
+    def test_dataset(self):
+        self.assertEquals(self.get_sources('/prototypical.json?dataset=v2'), {'Fox'})
+        self.assertEquals(self.get_sources('/query.json?dataset=v2&search=b'), {'Fox'})
+
+        response = self.__client.get('/stats.json?dataset=v2')
+        self.assertEquals(response.status_code, 200)
+        stats = json.loads(response.data)
+        self.assertEquals([x['source'] for x in stats['sources']], ['Fox'])
+        self.assertEquals(stats['sources'][0]['count'], 2)
+
+        self.assertEquals(self.__loaded_paths, ['predictions_v2.csv'])
+
+    def test_unknown_dataset(self):
+        for url in ['/prototypical.json', '/query.json?search=a', '/stats.json']:
+            separator = '&' if '?' in url else '?'
+            response = self.__client.get(url + separator + 'dataset=v3')
+            self.assertEquals(response.status_code, 404)
+
+        self.assertEquals(self.__loaded_paths, [])
+
+    def test_dataset_without_registry(self):
+        app = server.create_app(
+            flask.Flask(server.__name__),
+            model.ArticleKeep(create_records()),
+            None
+        )
+        response = app.test_client().get('/prototypical.json?dataset=v2')
+        self.assertEquals(response.status_code, 404)
@@ -19,75 +19,885 @@ NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FO
 OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
+import ctypes
 import datetime
+import fcntl
 import hashlib
+import json
 import multiprocessing
+import os
 import random
+import struct
+import tempfile
+import threading
 import time
 
+import util
+
 
 INSERT_TEMPLATE = '''INSERT INTO actions (ipAddressHash, userAgent, page, query, timestampStr) VALUES (?, ?, ?, ?, ?)'''
 
+ROLLUP_INSERT_TEMPLATE = '''INSERT INTO actionRollups (minuteStr, ipAddressHash, page, query, actionCount) VALUES (?, ?, ?, ?, ?)'''
+
+ACTION_ROW = 'action'
+ROLLUP_ROW = 'rollup'
+
+SEGMENT_PREFIX = 'segment_'
+SEGMENT_SUFFIX = '.jsonl'
+OWNER_PREFIX = 'spool_'
+OWNER_LOCK_NAME = 'owner.lock'
+ADOPT_LOCK_NAME = 'adopt.lock'
+
+IP_ADDRESS_BYTES = 46
+USER_AGENT_BYTES = 256
+PAGE_BYTES = 16
+QUERY_BYTES = 256
+
+EVENT_STRUCT = struct.Struct('<dHHHH%ds%ds%ds%ds' % (
+    IP_ADDRESS_BYTES,
+    USER_AGENT_BYTES,
+    PAGE_BYTES,
+    QUERY_BYTES
+))
+
+HEAD_COUNTER = 0
+TAIL_COUNTER = 1
+DROPPED_COUNTER = 2
+CLOSED_COUNTER = 3
+NUM_COUNTERS = 4
+
+SPOOL_PENDING_STAT = 0
+SPOOL_DROPPED_STAT = 1
+SPOOL_CORRUPT_STAT = 2
+DISCARDED_STAT = 3
+NUM_STATS = 4
+
+
+class TelemetrySpool:
+    """Append-only on-disk spool of telemetry rows awaiting a write to the database.
+
+    Rows are written as JSON lines into numbered segment files inside a directory. Segments are
+    replayed oldest first and deleted only after the database accepts them. If the spool grows
+    beyond its size cap, the oldest closed segments are discarded.
+
+    Several processes may share a spool directory. Each spool writes to its own subdirectory and
+    holds an exclusive lock on it for its lifetime. Subdirectories whose lock is free belong to
+    processes which have exited and their segments are adopted by a live spool.
+    """
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, segment_bytes=1024 * 1024):
+        """Create a new spool, picking up any segments left behind by exited processes.
+
+        Args:
+            directory: Path to the directory shared by spools in which segment files should be
+                kept. Created if it does not exist.
+            max_bytes: Maximum number of bytes the spool may occupy on disk before the oldest
+                segments are dropped.
+            segment_bytes: Size in bytes after which the active segment is closed and a new one
+                started.
+        """
+        self.__directory = directory
+        self.__max_bytes = max_bytes
+        self.__segment_bytes = segment_bytes
+        self.__active_file = None
+        self.__active_path = None
+        self.__dropped_rows = 0
+        self.__corrupt_rows = 0
+
+        self.__segment_sizes = {}
+        self.__segment_rows = {}
+        self.__segment_bad_rows = {}
+        self.__next_segment_id = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+        with open(os.path.join(directory, ADOPT_LOCK_NAME), 'a') as adopt_lock:
+            fcntl.flock(adopt_lock, fcntl.LOCK_EX)
+
+            self.__own_directory = tempfile.mkdtemp(prefix=OWNER_PREFIX, dir=directory)
+            self.__owner_lock = open(os.path.join(self.__own_directory, OWNER_LOCK_NAME), 'a')
+            fcntl.flock(self.__owner_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+            self.__adopt_orphans_locked()
+
+    def adopt_orphans(self):
+        """Move segments left behind by exited processes into this spool."""
+        with open(os.path.join(self.__directory, ADOPT_LOCK_NAME), 'a') as adopt_lock:
+            fcntl.flock(adopt_lock, fcntl.LOCK_EX)
+            self.__adopt_orphans_locked()
+
+    def append(self, row):
+        """Append a single row to the active segment.
+
+        Args:
+            row: Tuple of strings to be written through INSERT_TEMPLATE once the database is
+                available.
+        """
+        if self.__active_file is None:
+            self.__open_segment()
+
+        line = (json.dumps(list(row)) + '\n').encode('utf-8')
+        self.__active_file.write(line)
+        self.__active_file.flush()
+        self.__segment_sizes[self.__active_path] += len(line)
+        self.__segment_rows[self.__active_path] += 1
+
+        if self.__segment_sizes[self.__active_path] >= self.__segment_bytes:
+            self.__close_segment()
+
+        self.__enforce_cap()
+
+    def drain(self, write_rows, prepare_row=None):
+        """Replay spooled rows oldest segment first, deleting each segment once written.
+
+        Args:
+            write_rows: Function taking a list of row tuples which writes them to the database
+                and raises if the write fails. Called once per segment.
+            prepare_row: Optional function taking a decoded row tuple and returning the row tuple
+                to write or None if the row cannot be written. Rows for which it returns None are
+                skipped and counted with corrupt rows. If None, all decoded rows are written as is.
+        Returns:
+            Number of rows replayed.
+        """
+        self.__close_segment()
+
+        count = 0
+        for path in sorted(self.__segment_sizes.keys()):
+            (rows, bad_rows) = self.__read_segment(path)
+
+            if prepare_row is not None:
+                prepared_rows = [prepare_row(row) for row in rows]
+                valid_rows = [row for row in prepared_rows if row is not None]
+                bad_rows += len(rows) - len(valid_rows)
+                rows = valid_rows
+
+            if not path in self.__segment_bad_rows:
+                self.__segment_bad_rows[path] = bad_rows
+                self.__corrupt_rows += bad_rows
+
+            if rows:
+                write_rows(rows)
+
+            self.__remove_segment(path)
+            count += len(rows)
+
+        return count
+
+    def is_empty(self):
+        """Determine if the spool has any rows awaiting replay.
+
+        Returns:
+            True if there are no spooled rows and false otherwise.
+        """
+        return self.get_size_bytes() == 0
+
+    def get_size_bytes(self):
+        """Get the number of bytes currently occupied by spooled rows.
+
+        Returns:
+            Integer size in bytes across all segments.
+        """
+        return sum(self.__segment_sizes.values())
+
+    def get_size_rows(self):
+        """Get the number of rows currently awaiting replay, excluding those known to be corrupt.
+
+        Returns:
+            Integer count of rows across all segments.
+        """
+        total_rows = sum(self.__segment_rows.values())
+        return total_rows - sum(self.__segment_bad_rows.values())
+
+    def get_dropped_rows(self):
+        """Get the number of rows discarded to keep the spool within its size cap.
+
+        Returns:
+            Integer count of rows dropped since this spool was created.
+        """
+        return self.__dropped_rows
+
+    def get_corrupt_rows(self):
+        """Get the number of lines skipped during replay because they could not be decoded.
+
+        These are typically rows only partly written when a previous process died mid-append or
+        rows rejected by the prepare_row function given to drain. Each is counted once even if its
+        segment is read again after a failed replay.
+
+        Returns:
+            Integer count of lines skipped since this spool was created.
+        """
+        return self.__corrupt_rows
+
+    def close(self):
+        """Close this spool, leaving spooled rows on disk to be adopted by another spool.
+
+        The spool should not be used after closing.
+        """
+        self.__close_segment()
+
+        with open(os.path.join(self.__directory, ADOPT_LOCK_NAME), 'a') as adopt_lock:
+            fcntl.flock(adopt_lock, fcntl.LOCK_EX)
+
+            if not self.__segment_sizes:
+                os.remove(os.path.join(self.__own_directory, OWNER_LOCK_NAME))
+                os.rmdir(self.__own_directory)
+
+            self.__owner_lock.close()
+
+    def __list_segments(self, directory):
+        """List existing segment files in a directory.
+
+        Args:
+            directory: The path to the directory to list.
+        Returns:
+            Sorted list of paths to segment files.
+        """
+        names = filter(
+            lambda x: x.startswith(SEGMENT_PREFIX) and x.endswith(SEGMENT_SUFFIX),
+            os.listdir(directory)
+        )
+        return sorted([os.path.join(directory, name) for name in names])
+
+    def __adopt_orphans_locked(self):
+        """Adopt segments from exited processes. Must be called holding the adopt lock.
+
+        Segments directly inside the shared directory (written before spools used subdirectories)
+        are adopted as well.
+        """
+        self.__adopt_segments(self.__directory)
+
+        for name in sorted(os.listdir(self.__directory)):
+            path = os.path.join(self.__directory, name)
+            is_candidate = name.startswith(OWNER_PREFIX) and os.path.isdir(path)
+            if not is_candidate or path == self.__own_directory:
+                continue
+
+            lock_path = os.path.join(path, OWNER_LOCK_NAME)
+            with open(lock_path, 'a') as owner_lock:
+                try:
+                    fcntl.flock(owner_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+
+                self.__adopt_segments(path)
+                os.remove(lock_path)
+
+            os.rmdir(path)
+
+    def __adopt_segments(self, directory):
+        """Move the segments in a directory into this spool's directory.
+
+        Args:
+            directory: The path to the directory whose segments should be moved.
+        """
+        for old_path in self.__list_segments(directory):
+            name = '%s%016d%s' % (SEGMENT_PREFIX, self.__next_segment_id, SEGMENT_SUFFIX)
+            self.__next_segment_id += 1
+
+            path = os.path.join(self.__own_directory, name)
+            os.rename(old_path, path)
+
+            self.__segment_sizes[path] = os.path.getsize(path)
+            with open(path, 'rb') as f:
+                self.__segment_rows[path] = sum(1 for line in f if line.strip() != b'')
+
+    def __read_segment(self, path):
+        """Read the rows in a segment, skipping lines which cannot be decoded.
+
+        Args:
+            path: The path to the segment file.
+        Returns:
+            Tuple of (list of row tuples, integer count of lines which could not be decoded).
+        """
+        rows = []
+        bad_rows = 0
+
+        with open(path, 'rb') as f:
+            for line in f:
+                if line.strip() == b'':
+                    continue
+
+                try:
+                    rows.append(tuple(json.loads(line.decode('utf-8'))))
+                except ValueError:
+                    bad_rows += 1
+
+        return (rows, bad_rows)
+
+    def __remove_segment(self, path):
+        """Delete a segment and forget its counts.
+
+        Args:
+            path: The path to the segment file.
+        """
+        os.remove(path)
+        del self.__segment_sizes[path]
+        del self.__segment_rows[path]
+        self.__segment_bad_rows.pop(path, None)
+
+    def __open_segment(self):
+        """Start a new active segment."""
+        name = '%s%016d%s' % (SEGMENT_PREFIX, self.__next_segment_id, SEGMENT_SUFFIX)
+        self.__next_segment_id += 1
+
+        self.__active_path = os.path.join(self.__own_directory, name)
+        self.__active_file = open(self.__active_path, 'ab')
+        self.__segment_sizes[self.__active_path] = 0
+        self.__segment_rows[self.__active_path] = 0
+
+    def __close_segment(self):
+        """Close the active segment if one is open."""
+        if self.__active_file is None:
+            return
+
+        self.__active_file.close()
+        self.__active_file = None
+        self.__active_path = None
+
+    def __enforce_cap(self):
+        """Drop the oldest closed segments until the spool is within its size cap."""
+        closed_paths = sorted(filter(
+            lambda x: x != self.__active_path,
+            self.__segment_sizes.keys()
+        ))
+
+        for path in closed_paths:
+            if self.get_size_bytes() <= self.__max_bytes:
+                return
+
+            bad_rows = self.__segment_bad_rows.get(path, 0)
+            self.__dropped_rows += self.__segment_rows[path] - bad_rows
+            self.__remove_segment(path)
+
+
+class EventRing:
+    """Fixed-size ring buffer of telemetry events in memory shared with the worker process.
+
+    Each event is packed into a fixed-size EVENT_STRUCT slot so that reporting from the request path
+    requires neither a dictionary nor pickling. Strings longer than their slot are truncated. If the
+    ring is full, new events are dropped and counted rather than blocking the request.
+
+    No lock is shared between processes so a consumer which dies cannot block the request path.
+    Producer threads in the process which created the ring serialize on an in-process lock and are
+    the only writers of HEAD_COUNTER. A single consumer is the only writer of TAIL_COUNTER. Events put
+    from any other process (for example one forked after the ring was created) are dropped and
+    counted.
+    """
+
+    def __init__(self, capacity=4096):
+        """Create a new empty ring.
+
+        Args:
+            capacity: Maximum number of events which may be waiting for the consumer.
+        """
+        self.__capacity = capacity
+        self.__buffer = multiprocessing.RawArray(ctypes.c_char, capacity * EVENT_STRUCT.size)
+        self.__counters = multiprocessing.RawArray(ctypes.c_ulonglong, NUM_COUNTERS)
+        self.__producer_pid = os.getpid()
+        self.__producer_lock = threading.Lock()
+
+    def __getstate__(self):
+        """Get state for sending this ring to the consumer process.
+
+        Returns:
+            Dictionary of attributes excluding the in-process producer lock.
+        """
+        state = dict(self.__dict__)
+        del state['_EventRing__producer_lock']
+        return state
+
+    def __setstate__(self, state):
+        """Restore a ring sent to the consumer process.
+
+        Args:
+            state: Dictionary of attributes from __getstate__.
+        """
+        self.__dict__.update(state)
+        self.__producer_lock = threading.Lock()
+
+    def put(self, ip_address, user_agent, page, query):
+        """Record a new event with the current time.
+
+        Args:
+            ip_address: String IP address of the client.
+            user_agent: String user agent of the client.
+            page: String page name.
+            query: String query or empty if no query.
+        Returns:
+            True if the event was recorded and false if it was dropped because the ring is full or
+            this is not the process which created the ring.
+        """
+        timestamp = time.time()
+        ip_address_bytes = (ip_address or '').encode('utf-8')[:IP_ADDRESS_BYTES]
+        user_agent_bytes = (user_agent or '').encode('utf-8')[:USER_AGENT_BYTES]
+        page_bytes = page.encode('utf-8')[:PAGE_BYTES]
+        query_bytes = (query or '').encode('utf-8')[:QUERY_BYTES]
+
+        counters = self.__counters
+        with self.__producer_lock:
+            if os.getpid() != self.__producer_pid:
+                counters[DROPPED_COUNTER] += 1
+                return False
+
+            head = counters[HEAD_COUNTER]
+            if head - counters[TAIL_COUNTER] >= self.__capacity:
+                counters[DROPPED_COUNTER] += 1
+                return False
+
+            EVENT_STRUCT.pack_into(
+                self.__buffer,
+                (head % self.__capacity) * EVENT_STRUCT.size,
+                timestamp,
+                len(ip_address_bytes),
+                len(user_agent_bytes),
+                len(page_bytes),
+                len(query_bytes),
+                ip_address_bytes,
+                user_agent_bytes,
+                page_bytes,
+                query_bytes
+            )
+            counters[HEAD_COUNTER] = head + 1
+
+        return True
+
+    def get_batch(self, max_count):
+        """Remove and decode up to max_count of the oldest events.
+
+        Must only be called from a single consumer.
+
+        Args:
+            max_count: Maximum number of events to return.
+        Returns:
+            List of tuples of (timestamp, ip_address, user_agent, page, query) where timestamp is
+            float seconds since epoch. Empty if no events are waiting.
+        """
+        size = EVENT_STRUCT.size
+        counters = self.__counters
+
+        tail = counters[TAIL_COUNTER]
+        count = min(counters[HEAD_COUNTER] - tail, max_count)
+        start = (tail % self.__capacity) * size
+        end = start + count * size
 
-def run_worker_logic(task_queue, db_connection_generator, min_wait, max_wait, use_question_mark):
+        if end <= len(self.__buffer):
+            raw = self.__buffer[start:end]
+        else:
+            raw = self.__buffer[start:] + self.__buffer[:end - len(self.__buffer)]
+
+        counters[TAIL_COUNTER] = tail + count
+
+        return [decode_event(values) for values in EVENT_STRUCT.iter_unpack(raw)]
+
+    def get_dropped_count(self):
+        """Get the number of events dropped because the ring was full.
+
+        Returns:
+            Integer count of dropped events.
+        """
+        return self.__counters[DROPPED_COUNTER]
+
+    def get_depth(self):
+        """Get the number of events waiting for the consumer.
+
+        Counters are read while producers and the consumer run so the count is approximate.
+
+        Returns:
+            Integer count of waiting events.
+        """
+        tail = self.__counters[TAIL_COUNTER]
+        return self.__counters[HEAD_COUNTER] - tail
+
+    def close(self):
+        """Signal to the consumer that no more events will be recorded."""
+        self.__counters[CLOSED_COUNTER] = 1
+
+    def is_closed(self):
+        """Determine if the producer has finished recording events.
+
+        Returns:
+            True if close has been called and false otherwise.
+        """
+        return self.__counters[CLOSED_COUNTER] == 1
+
+
+def decode_event(values):
+    """Decode a raw unpacked EVENT_STRUCT.
+
+    Args:
+        values: Tuple of values unpacked from EVENT_STRUCT.
+    Returns:
+        Tuple of (timestamp, ip_address, user_agent, page, query).
+    """
+    (timestamp, ip_address_len, user_agent_len, page_len, query_len, ip_address, user_agent,
+        page, query) = values
+
+    return (
+        timestamp,
+        ip_address[:ip_address_len].decode('utf-8', errors='ignore'),
+        user_agent[:user_agent_len].decode('utf-8', errors='ignore'),
+        page[:page_len].decode('utf-8', errors='ignore'),
+        query[:query_len].decode('utf-8', errors='ignore')
+    )
+
+
+def prepare_rows(events):
+    """Convert a batch of events into rows for INSERT_TEMPLATE.
+
+    Hashes are computed once per distinct IP address and user agent pair in the batch.
+
+    Args:
+        events: List of event tuples as returned by EventRing.get_batch.
+    Returns:
+        List of row tuples (ipAddressHash, userAgent, page, query, timestampStr).
+    """
+    hashes = {}
+    rows = []
+
+    for (timestamp, ip_address, user_agent, page, query) in events:
+        hash_key = (ip_address, user_agent)
+        if hash_key not in hashes:
+            hashable_str = ip_address + user_agent
+            hashes[hash_key] = hashlib.sha224(hashable_str.encode('utf-8')).hexdigest()
+
+        timestamp_str = datetime.datetime.utcfromtimestamp(timestamp).isoformat()
+        rows.append((hashes[hash_key], user_agent, page, query, timestamp_str))
+
+    return rows
+
+
+def is_tagged_row(row):
+    """Determine if a row starts with a tag indicating the template through which it is written.
+
+    Args:
+        row: Row tuple to check.
+    Returns:
+        True if the first element is ACTION_ROW or ROLLUP_ROW and false otherwise.
+    """
+    return len(row) > 0 and row[0] in (ACTION_ROW, ROLLUP_ROW)
+
+
+def tag_spooled_row(row):
+    """Prepare a spooled row for write_rows, tagging rows spooled before tags were introduced.
+
+    Args:
+        row: Row tuple read from a TelemetrySpool.
+    Returns:
+        The row if already tagged, the row tagged with ACTION_ROW if it is an untagged actions row
+        of the five INSERT_TEMPLATE columns, or None if the row is not recognized.
+    """
+    if is_tagged_row(row):
+        return row
+    elif len(row) == 5:
+        return (ACTION_ROW,) + tuple(row)
+    else:
+        return None
+
+
+def normalize_query(query):
+    """Normalize a query so that equivalent searches are counted together.
+
+    Args:
+        query: The string query as provided by the user.
+    Returns:
+        String of the unique lowercase words in the query, sorted and separated by spaces.
+    """
+    return ' '.join(sorted(util.get_words(query)))
+
+
+def get_minute_str(timestamp_str):
+    """Truncate an ISO formatted timestamp to the minute.
+
+    Args:
+        timestamp_str: ISO formatted timestamp like 2019-01-01T12:30:15.123456.
+    Returns:
+        ISO formatted minute like 2019-01-01T12:30.
+    """
+    return timestamp_str[:16]
+
+
+class RollupAccumulator:
+    """In-memory per-minute counts of actions by page, normalized query, and hashed visitor."""
+
+    def __init__(self):
+        """Create a new empty accumulator."""
+        self.__counts = {}
+
+    def add_rows(self, rows):
+        """Count action rows.
+
+        Args:
+            rows: List of row tuples (ipAddressHash, userAgent, page, query, timestampStr) as
+                returned by prepare_rows.
+        """
+        counts = self.__counts
+        for (ip_address_hash, user_agent, page, query, timestamp_str) in rows:
+            key = (get_minute_str(timestamp_str), ip_address_hash, page, normalize_query(query))
+            counts[key] = counts.get(key, 0) + 1
+
+    def pop_before(self, minute_str):
+        """Remove and return the counts for minutes before the given minute.
+
+        Args:
+            minute_str: ISO formatted minute. Counts for this minute and later are kept.
+        Returns:
+            List of rollup row tuples (minuteStr, ipAddressHash, page, query, actionCount).
+        """
+        keys = [key for key in self.__counts.keys() if key[0] < minute_str]
+        return [key + (self.__counts.pop(key),) for key in keys]
+
+    def pop_all(self):
+        """Remove and return all counts.
+
+        Returns:
+            List of rollup row tuples (minuteStr, ipAddressHash, page, query, actionCount).
+        """
+        rows = [key + (count,) for (key, count) in self.__counts.items()]
+        self.__counts = {}
+        return rows
+
+    def is_empty(self):
+        """Determine if there are any counts waiting to be written.
+
+        Returns:
+            True if no actions have been counted since the last pop and false otherwise.
+        """
+        return len(self.__counts) == 0
+
+
+def run_worker_logic(event_ring, db_connection_generator, min_wait, max_wait, use_question_mark,
+        spool_dir=None, max_spool_bytes=64 * 1024 * 1024, batch_size=512, aggregate=False,
+        raw_sample_rate=0, worker_stats=None):
     """Run worker process logic.
 
+    Events are taken from the ring in batches, hashed and formatted together, and written in a
+    single transaction per batch. Rows which cannot be written because the database is unavailable
+    are kept in a TelemetrySpool (if spool_dir is given) and replayed in bulk once the database
+    accepts writes again.
+
+    If aggregate is set, actions are counted per minute in a RollupAccumulator and each completed
+    minute is written through ROLLUP_INSERT_TEMPLATE instead of writing one row per action. A random
+    sample of actions may still be written individually through INSERT_TEMPLATE. Counts for a
+    minute may be split across rows if events arrive late so dashboards should sum actionCount.
+
     Args:
-        task_queue: Queue to control records to be written.
+        event_ring: EventRing from which events should be consumed.
         db_connection_generator: Function taking no arguments and returning DB API v2 compliant
             connection interface through which the record should be created.
         min_wait: Minimum millisecond delay before checking for new tasks.
         max_wait: Maximum millisecond delay before checking for new tasks.
         use_question_mark: Flag indicating if question marks should be used in insert template.
             If true, uses ?. If false, uses %s.
+        spool_dir: Optional path to directory in which to spool rows during database outages. If
+            None, rows which cannot be written are dropped.
+        max_spool_bytes: Maximum size in bytes of the spool on disk.
+        batch_size: Maximum number of events to take from the ring at once.
+        aggregate: Flag indicating if per-minute rollups should be written instead of one row per
+            action.
+        raw_sample_rate: Fraction from 0 to 1 of actions to also write individually when
+            aggregating. Ignored if aggregate is false.
+        worker_stats: Optional shared array of NUM_STATS integers into which the number of rows
+            pending in the spool (SPOOL_PENDING_STAT), dropped by the spool size cap
+            (SPOOL_DROPPED_STAT), skipped as corrupt during replay (SPOOL_CORRUPT_STAT), and
+            discarded after a failed write without a spool (DISCARDED_STAT) are published.
     """
 
     if use_question_mark:
         insert_sql = INSERT_TEMPLATE
+        rollup_sql = ROLLUP_INSERT_TEMPLATE
     else:
         insert_sql = INSERT_TEMPLATE.replace('?', '%s')
+        rollup_sql = ROLLUP_INSERT_TEMPLATE.replace('?', '%s')
+
+    accumulator = RollupAccumulator()
+
+    if spool_dir is None:
+        spool = None
+    else:
+        spool = TelemetrySpool(spool_dir, max_bytes=max_spool_bytes)
+
+    connection_holder = {'connection': None}
+    retry_state = {'nextAttempt': 0}
+    discarded = {'count': 0}
 
-    def execute_task(task):
-        """Inner closure that executes a single task.
+    def write_rows(tagged_rows):
+        """Inner closure that writes rows in a single transaction.
 
         Args:
-            task: Dictionary describing the task to exeucte.
+            tagged_rows: List of row tuples to be inserted whose first element is ACTION_ROW or
+                ROLLUP_ROW indicating the template through which the rest should be written.
         """
-        db_connection = db_connection_generator()
-        cursor = db_connection.cursor()
+        if not all(map(is_tagged_row, tagged_rows)):
+            raise ValueError('Rows must be tagged with ACTION_ROW or ROLLUP_ROW.')
 
-        ip_address = task['ipAddress']
-        user_agent = task['userAgent']
-        page = task['page']
-        query = task['query']
-        timestamp_str = task['timestampStr']
+        action_rows = [row[1:] for row in tagged_rows if row[0] == ACTION_ROW]
+        rollup_rows = [row[1:] for row in tagged_rows if row[0] == ROLLUP_ROW]
 
-        hashable_str = ip_address + user_agent
-        ip_address_hash = hashlib.sha224(hashable_str.encode('utf-8')).hexdigest()
+        if connection_holder['connection'] is None:
+            connection_holder['connection'] = db_connection_generator()
 
-        cursor.execute(
-            insert_sql,
-            (ip_address_hash, user_agent, page, query, timestamp_str)
-        )
+        db_connection = connection_holder['connection']
+        cursor = db_connection.cursor()
+
+        if action_rows:
+            cursor.executemany(insert_sql, action_rows)
+
+        if rollup_rows:
+            cursor.executemany(rollup_sql, rollup_rows)
 
         db_connection.commit()
 
+    def reset_connection():
+        """Inner closure that discards a connection after a failed write and delays retries."""
+        retry_wait = random.randint(min_wait, max_wait) / 1000
+        retry_state['nextAttempt'] = time.time() + retry_wait
+
+        db_connection = connection_holder['connection']
+        connection_holder['connection'] = None
+
+        if db_connection is None:
+            return
+
+        try:
+            db_connection.close()
+        except Exception:
+            pass
+
+    def replay_spool():
+        """Inner closure that attempts to flush spooled rows to the database.
+
+        Returns:
+            True if the spool is now empty and false otherwise.
+        """
+        if spool is None or spool.is_empty():
+            return True
+
+        if time.time() < retry_state['nextAttempt']:
+            return False
+
+        try:
+            spool.drain(write_rows, prepare_row=tag_spooled_row)
+            return True
+        except Exception:
+            reset_connection()
+            return False
+
+    def spool_rows(rows):
+        """Inner closure that keeps rows for a later replay if spooling is enabled.
+
+        Rows which cannot be spooled, for example because the disk is full, are discarded and
+        counted rather than stopping the worker.
+
+        Args:
+            rows: List of tagged row tuples which could not be written.
+        """
+        if spool is None:
+            discarded['count'] += len(rows)
+            return
+
+        for row in rows:
+            try:
+                spool.append(row)
+            except OSError:
+                discarded['count'] += 1
+
+    def publish_stats():
+        """Inner closure that shares counts of unwritten rows with the reporting process."""
+        if worker_stats is None:
+            return
+
+        worker_stats[DISCARDED_STAT] = discarded['count']
+
+        if spool is not None:
+            worker_stats[SPOOL_PENDING_STAT] = spool.get_size_rows()
+            worker_stats[SPOOL_DROPPED_STAT] = spool.get_dropped_rows()
+            worker_stats[SPOOL_CORRUPT_STAT] = spool.get_corrupt_rows()
+
+    def write_or_spool(tagged_rows):
+        """Inner closure that writes rows, spooling them if the database is unavailable.
+
+        Args:
+            tagged_rows: List of tagged row tuples to write.
+        """
+        if not tagged_rows:
+            return
+
+        if not replay_spool():
+            spool_rows(tagged_rows)
+            return
+
+        try:
+            write_rows(tagged_rows)
+        except Exception:
+            reset_connection()
+            spool_rows(tagged_rows)
+
+    def execute_batch(events):
+        """Inner closure that executes a batch of events.
+
+        Args:
+            events: List of event tuples to write.
+        """
+        rows = prepare_rows(events)
+
+        if aggregate:
+            accumulator.add_rows(rows)
+            rows = [row for row in rows if random.random() < raw_sample_rate]
+
+        write_or_spool([(ACTION_ROW,) + row for row in rows])
+
+    def flush_rollups(flush_all):
+        """Inner closure that writes counts for completed minutes.
+
+        Args:
+            flush_all: Flag indicating if counts for the current minute should also be written.
+        """
+        if accumulator.is_empty():
+            return
+
+        if flush_all:
+            rollup_rows = accumulator.pop_all()
+        else:
+            current_minute = get_minute_str(datetime.datetime.utcnow().isoformat())
+            rollup_rows = accumulator.pop_before(current_minute)
+
+        write_or_spool([(ROLLUP_ROW,) + row for row in rollup_rows])
+
     while True:
-        task = task_queue.get()
+        closed = event_ring.is_closed()
+        events = event_ring.get_batch(batch_size)
 
-        if task is None:
-            time.sleep(random.randint(min_wait, max_wait) / 1000)
+        if events:
+            execute_batch(events)
+            flush_rollups(False)
+            publish_stats()
+        elif closed:
+            retry_state['nextAttempt'] = 0
+            flush_rollups(True)
+            replay_spool()
+            if spool is not None:
+                spool.close()
+            reset_connection()
+            publish_stats()
+            return
         else:
-            if task['end']:
-                return
+            flush_rollups(False)
+            if spool is not None:
+                try:
+                    spool.adopt_orphans()
+                except OSError:
+                    pass
+            replay_spool()
+            publish_stats()
+            time.sleep(random.randint(min_wait, max_wait) / 1000)
 
-            execute_task(task)
 
 class UsageReporter:
     """Utility which runs a reporting subprocess for user actions."""
 
     def __init__(self, db_connection_generator, min_wait=1000, max_wait=5000,
-            use_question_mark=False):
+            use_question_mark=False, spool_dir=None, max_spool_bytes=64 * 1024 * 1024,
+            ring_capacity=4096, aggregate=False, raw_sample_rate=0):
         """Create a new reporter.
 
         Args:
@@ -97,15 +907,32 @@ class UsageReporter:
             min_wait: Maximum delay before processing new tasks.
             Flag indicating if question marks should be used in insert template.
                 If true, uses ?. If false, uses %s.
+            spool_dir: Optional path to directory in which to spool records while the database is
+                unavailable. If None, records which cannot be written are dropped.
+            max_spool_bytes: Maximum size in bytes of the spool on disk.
+            ring_capacity: Maximum number of events which may wait for the worker before new
+                events are dropped.
+            aggregate: Flag indicating if per-minute rollups should be written to actionRollups
+                instead of one row per action to actions.
+            raw_sample_rate: Fraction from 0 to 1 of actions to also write individually to actions
+                when aggregating.
         """
-        self.__db_connection = db_connection_generator()
+        event_ring = EventRing(capacity=ring_capacity)
+        self.__event_ring = event_ring
 
-        task_queue = multiprocessing.Queue()
-        self.__queue = task_queue
+        worker_stats = multiprocessing.RawArray(ctypes.c_ulonglong, NUM_STATS)
+        self.__worker_stats = worker_stats
 
         self.__inner_process = multiprocessing.Process(
             target=run_worker_logic,
-            args=(task_queue, db_connection_generator, min_wait, max_wait, use_question_mark)
+            args=(event_ring, db_connection_generator, min_wait, max_wait, use_question_mark),
+            kwargs={
+                'spool_dir': spool_dir,
+                'max_spool_bytes': max_spool_bytes,
+                'aggregate': aggregate,
+                'raw_sample_rate': raw_sample_rate,
+                'worker_stats': worker_stats
+            }
         )
 
         self.__inner_process.start()
@@ -119,18 +946,41 @@ class UsageReporter:
             page: String page name.
             query: String query or empty if no query.
         """
-        self.__queue.put({
-            'ipAddress': ip_address,
-            'userAgent': user_agent,
-            'page': page,
-            'query': query,
-            'timestampStr': datetime.datetime.utcnow().isoformat(),
-            'end': False
-        })
+        self.__event_ring.put(ip_address, user_agent, page, query)
+
+    def get_dropped_count(self):
+        """Get the number of events dropped because the worker fell behind.
+
+        Returns:
+            Integer count of dropped events.
+        """
+        return self.__event_ring.get_dropped_count()
+
+    def get_queue_depth(self):
+        """Get the number of events waiting for the worker.
+
+        Returns:
+            Integer count of waiting events.
+        """
+        return self.__event_ring.get_depth()
+
+    def get_worker_stats(self):
+        """Get counts of rows the worker has not written, as last published by the worker.
+
+        Returns:
+            Dictionary with the number of rows pending in the spool (spoolPendingRows), dropped by
+            the spool size cap (spoolDroppedRows), skipped as corrupt during replay
+            (spoolCorruptRows), and discarded after a failed write without a spool
+            (discardedRows).
+        """
+        return {
+            'spoolPendingRows': self.__worker_stats[SPOOL_PENDING_STAT],
+            'spoolDroppedRows': self.__worker_stats[SPOOL_DROPPED_STAT],
+            'spoolCorruptRows': self.__worker_stats[SPOOL_CORRUPT_STAT],
+            'discardedRows': self.__worker_stats[DISCARDED_STAT]
+        }
 
     def terminate(self):
         """Terminate the inner subprocess"""
-        self.__queue.put({'end': True})
+        self.__event_ring.close()
         self.__inner_process.join()
-        self.__queue.close()
-        self.__queue.join_thread()
@@ -0,0 +1,111 @@
+"""Microbenchmark for the per-request overhead of reporting telemetry.
+
+Usage: $ python telemetry_bench.py [number of events]
+
+----
+
+Copyright 2019 Data Driven Empathy LLC
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial
+portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES
+OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import telemetry
+
+TARGET_MICROSECONDS = 10
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/76.0'
+
+
+def create_db(path):
+    """Create the actions table in a new SQLite database.
+
+    Args:
+        path: The path at which the database should be created.
+    """
+    db_connection = sqlite3.connect(path)
+    db_connection.cursor().execute('''
+        CREATE TABLE actions (
+            ipAddressHash TEXT,
+            userAgent TEXT,
+            page TEXT,
+            query TEXT,
+            timestampStr TEXT
+        )
+    ''')
+    db_connection.commit()
+    db_connection.close()
+
+
+def time_report_usage(reporter, num_events):
+    """Time calls to report_usage one at a time.
+
+    Args:
+        reporter: The telemetry.UsageReporter to exercise.
+        num_events: The number of events to report.
+    Returns:
+        Sorted list of float microseconds taken by each call.
+    """
+    durations = []
+
+    for i in range(num_events):
+        start = time.perf_counter()
+        reporter.report_usage('192.168.0.%d' % (i % 256), USER_AGENT, 'query', 'climate change')
+        durations.append((time.perf_counter() - start) * 1000000)
+
+    return sorted(durations)
+
+
+def main():
+    """Run the benchmark and report results.
+
+    Returns:
+        Process exit code: 0 if the mean overhead is under the target and 1 otherwise.
+    """
+    num_events = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'bench.db')
+        create_db(db_path)
+
+        reporter = telemetry.UsageReporter(
+            lambda: sqlite3.connect(db_path),
+            min_wait=0,
+            max_wait=10,
+            use_question_mark=True,
+            ring_capacity=num_events
+        )
+
+        durations = time_report_usage(reporter, num_events)
+        dropped = reporter.get_dropped_count()
+        reporter.terminate()
+
+    mean = sum(durations) / len(durations)
+    p50 = durations[len(durations) // 2]
+    p99 = durations[int(len(durations) * 0.99)]
+
+    print('events: %d (dropped %d)' % (num_events, dropped))
+    print('report_usage mean: %.2f us, p50: %.2f us, p99: %.2f us' % (mean, p50, p99))
+    print('target: %d us' % TARGET_MICROSECONDS)
+
+    return 0 if mean < TARGET_MICROSECONDS else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,33 @@
+import glob
+import multiprocessing
+import os
+import shutil
 import sqlite3
+import tempfile
 import time
 import unittest
+import unittest.mock
 
 import telemetry
 
 
+def list_segments(directory):
+    return glob.glob(os.path.join(directory, '**', 'segment_*'), recursive=True)
+
+
+def consume_forever(event_ring):
+    while True:
+        event_ring.get_batch(16)
+
+
+def consume_once(event_ring, count):
+    count.value = len(event_ring.get_batch(16))
+
+
+def put_once(event_ring):
+    event_ring.put('test_ip', 'test_agent', 'test_page', '')
+
+
 class TelemetryTest(unittest.TestCase):
 
     def setUp(self):
@@ -50,3 +73,441 @@ class TelemetryTest(unittest.TestCase):
 
         rows = list(cursor.fetchall())
         self.assertEquals(len(rows), 1)
+
+
+class TelemetrySpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.__spool_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.__spool_dir)
+
+    def test_append_drain(self):
+        spool = telemetry.TelemetrySpool(self.__spool_dir)
+        spool.append(('hash', 'agent', 'page', 'query', 'time'))
+        self.assertFalse(spool.is_empty())
+
+        written = []
+        count = spool.drain(lambda rows: written.extend(rows))
+
+        self.assertEquals(count, 1)
+        self.assertEquals(written[0], ('hash', 'agent', 'page', 'query', 'time'))
+        self.assertTrue(spool.is_empty())
+        self.assertEquals(len(list_segments(self.__spool_dir)), 0)
+
+    def test_drain_failure_keeps_rows(self):
+        spool = telemetry.TelemetrySpool(self.__spool_dir)
+        spool.append(('hash', 'agent', 'page', 'query', 'time'))
+
+        def fail(rows):
+            raise IOError('unavailable')
+
+        with self.assertRaises(IOError):
+            spool.drain(fail)
+
+        self.assertFalse(spool.is_empty())
+
+    def test_drain_skips_truncated_line(self):
+        spool = telemetry.TelemetrySpool(self.__spool_dir)
+        spool.append(('hash', 'agent', 'page', 'query', 'time'))
+        spool.close()
+
+        with open(list_segments(self.__spool_dir)[0], 'ab') as f:
+            f.write(b'["hash", "age')
+
+        recovered = telemetry.TelemetrySpool(self.__spool_dir)
+        written = []
+        count = recovered.drain(lambda rows: written.extend(rows))
+
+        self.assertEquals(count, 1)
+        self.assertEquals(recovered.get_corrupt_rows(), 1)
+        self.assertTrue(recovered.is_empty())
+
+    def test_drain_prepare_rows(self):
+        spool = telemetry.TelemetrySpool(self.__spool_dir)
+        spool.append(('hash', 'agent', 'page', 'query', 'time'))
+        spool.append(('action', 'hash', 'agent', 'page', 'query', 'time'))
+        spool.append(('unknown',))
+
+        written = []
+        spool.drain(lambda rows: written.extend(rows), prepare_row=telemetry.tag_spooled_row)
+
+        self.assertEquals(written, [
+            ('action', 'hash', 'agent', 'page', 'query', 'time'),
+            ('action', 'hash', 'agent', 'page', 'query', 'time')
+        ])
+        self.assertEquals(spool.get_corrupt_rows(), 1)
+
+    def test_size_rows(self):
+        spool = telemetry.TelemetrySpool(self.__spool_dir, segment_bytes=10)
+        spool.append(('hash', 'agent', 'page', 'query', 'time'))
+        spool.append(('hash', 'agent', 'page', 'query', 'time'))
+        spool.close()
+
+        self.assertEquals(spool.get_size_rows(), 2)
+        self.assertEquals(telemetry.TelemetrySpool(self.__spool_dir).get_size_rows(), 2)
+
+    def test_corrupt_rows_counted_once(self):
+        spool = telemetry.TelemetrySpool(self.__spool_dir)
+        spool.append(('hash', 'agent', 'page', 'query', 'time'))
+        spool.append(('hash', 'agent', 'page', 'query'))
+
+        def fail(rows):
+            raise IOError('unavailable')
+
+        for i in range(3):
+            with self.assertRaises(IOError):
+                spool.drain(fail, prepare_row=lambda row: row if len(row) == 5 else None)
+
+        self.assertEquals(spool.get_corrupt_rows(), 1)
+        self.assertEquals(spool.get_size_rows(), 1)
+
+    def test_shared_directory(self):
+        spool_a = telemetry.TelemetrySpool(self.__spool_dir)
+        spool_b = telemetry.TelemetrySpool(self.__spool_dir)
+        spool_a.append(('hash', 'agent', 'page', 'query', 'a'))
+        spool_b.append(('hash', 'agent', 'page', 'query', 'b'))
+
+        written = []
+        spool_a.drain(lambda rows: written.extend(rows))
+        self.assertEquals(list(map(lambda x: x[4], written)), ['a'])
+
+        spool_a.adopt_orphans()
+        self.assertTrue(spool_a.is_empty())
+
+        spool_b.close()
+        spool_a.adopt_orphans()
+        spool_a.drain(lambda rows: written.extend(rows))
+        self.assertEquals(list(map(lambda x: x[4], written)), ['a', 'b'])
+
+        spool_a.close()
+        self.assertEquals(os.listdir(self.__spool_dir), [telemetry.ADOPT_LOCK_NAME])
+
+    def test_recover_existing(self):
+        spool = telemetry.TelemetrySpool(self.__spool_dir)
+        spool.append(('hash', 'agent', 'page', 'query', 'time'))
+        spool.close()
+
+        recovered = telemetry.TelemetrySpool(self.__spool_dir)
+        written = []
+        recovered.drain(lambda rows: written.extend(rows))
+        self.assertEquals(len(written), 1)
+
+    def test_cap(self):
+        spool = telemetry.TelemetrySpool(self.__spool_dir, max_bytes=100, segment_bytes=10)
+        for i in range(20):
+            spool.append(('hash', 'agent', 'page', 'query', str(i)))
+
+        self.assertTrue(spool.get_size_bytes() <= 100)
+        self.assertTrue(spool.get_dropped_rows() > 0)
+
+        written = []
+        spool.drain(lambda rows: written.extend(rows))
+        self.assertEquals(written[-1][4], '19')
+
+
+class EventRingTest(unittest.TestCase):
+
+    def test_put_get(self):
+        event_ring = telemetry.EventRing(capacity=4)
+        event_ring.put('test_ip', 'test_agent', 'test_page', 'test_query')
+
+        events = event_ring.get_batch(10)
+        self.assertEquals(len(events), 1)
+        self.assertEquals(events[0][1:], ('test_ip', 'test_agent', 'test_page', 'test_query'))
+        self.assertEquals(event_ring.get_depth(), 0)
+
+    def test_wrap(self):
+        event_ring = telemetry.EventRing(capacity=3)
+        for i in range(2):
+            event_ring.put('test_ip', 'test_agent', 'test_page', str(i))
+        event_ring.get_batch(2)
+
+        for i in range(2, 5):
+            event_ring.put('test_ip', 'test_agent', 'test_page', str(i))
+
+        queries = list(map(lambda x: x[4], event_ring.get_batch(10)))
+        self.assertEquals(queries, ['2', '3', '4'])
+
+    def test_full(self):
+        event_ring = telemetry.EventRing(capacity=2)
+        self.assertTrue(event_ring.put('test_ip', 'test_agent', 'test_page', ''))
+        self.assertTrue(event_ring.put('test_ip', 'test_agent', 'test_page', ''))
+        self.assertFalse(event_ring.put('test_ip', 'test_agent', 'test_page', ''))
+        self.assertEquals(event_ring.get_dropped_count(), 1)
+
+    def test_put_after_consumer_killed(self):
+        event_ring = telemetry.EventRing(capacity=64)
+        consumer = multiprocessing.Process(target=consume_forever, args=(event_ring,))
+        consumer.start()
+
+        for i in range(100):
+            event_ring.put('test_ip', 'test_agent', 'test_page', str(i))
+
+        consumer.kill()
+        consumer.join()
+
+        durations = []
+        for i in range(100):
+            start = time.perf_counter()
+            event_ring.put('test_ip', 'test_agent', 'test_page', str(i))
+            durations.append(time.perf_counter() - start)
+
+        self.assertTrue(max(durations) < 0.005)
+
+    def test_spawned_consumer(self):
+        context = multiprocessing.get_context('spawn')
+        event_ring = telemetry.EventRing(capacity=4)
+        event_ring.put('test_ip', 'test_agent', 'test_page', 'test_query')
+        count = context.RawValue('i', 0)
+
+        consumer = context.Process(target=consume_once, args=(event_ring, count))
+        consumer.start()
+        consumer.join()
+
+        self.assertEquals(count.value, 1)
+        self.assertEquals(event_ring.get_depth(), 0)
+
+    def test_put_from_other_process(self):
+        event_ring = telemetry.EventRing(capacity=4)
+        producer = multiprocessing.Process(target=put_once, args=(event_ring,))
+        producer.start()
+        producer.join()
+
+        self.assertEquals(event_ring.get_depth(), 0)
+        self.assertEquals(event_ring.get_dropped_count(), 1)
+
+    def test_truncate(self):
+        event_ring = telemetry.EventRing(capacity=2)
+        event_ring.put('test_ip', 'a' * 1000, 'test_page', None)
+
+        events = event_ring.get_batch(1)
+        self.assertEquals(len(events[0][2]), telemetry.USER_AGENT_BYTES)
+        self.assertEquals(events[0][4], '')
+
+    def test_prepare_rows(self):
+        rows = telemetry.prepare_rows([
+            (0, 'test_ip', 'test_agent', 'page_1', ''),
+            (0, 'test_ip', 'test_agent', 'page_2', '')
+        ])
+
+        self.assertEquals(len(rows), 2)
+        self.assertEquals(rows[0][0], rows[1][0])
+        self.assertEquals(rows[0][4], '1970-01-01T00:00:00')
+
+
+class RollupAccumulatorTest(unittest.TestCase):
+
+    def test_normalize_query(self):
+        self.assertEquals(telemetry.normalize_query('Climate  change climate'), 'change climate')
+
+    def test_pop_before(self):
+        accumulator = telemetry.RollupAccumulator()
+        accumulator.add_rows([
+            ('hash', 'agent', 'query', 'Climate change', '2019-01-01T12:30:01.000000'),
+            ('hash', 'agent', 'query', 'change climate', '2019-01-01T12:30:59.000000'),
+            ('hash', 'agent', 'query', 'climate change', '2019-01-01T12:31:00.000000')
+        ])
+
+        rows = accumulator.pop_before('2019-01-01T12:31')
+        self.assertEquals(rows, [('2019-01-01T12:30', 'hash', 'query', 'change climate', 2)])
+
+        rows = accumulator.pop_all()
+        self.assertEquals(rows, [('2019-01-01T12:31', 'hash', 'query', 'change climate', 1)])
+        self.assertTrue(accumulator.is_empty())
+
+
+class WorkerOutageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.__temp_dir = tempfile.mkdtemp()
+        self.__db_path = os.path.join(self.__temp_dir, 'outage.db')
+        self.__spool_dir = os.path.join(self.__temp_dir, 'spool')
+
+        db_connection = sqlite3.connect(self.__db_path)
+        db_connection.cursor().execute('''
+            CREATE TABLE actions (
+                ipAddressHash TEXT,
+                userAgent TEXT,
+                page TEXT,
+                query TEXT,
+                timestampStr TEXT
+            )
+        ''')
+        db_connection.cursor().execute('''
+            CREATE TABLE actionRollups (
+                minuteStr TEXT,
+                ipAddressHash TEXT,
+                page TEXT,
+                query TEXT,
+                actionCount INTEGER
+            )
+        ''')
+        db_connection.commit()
+        db_connection.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.__temp_dir)
+
+    def test_replay_after_outage(self):
+        attempts = {'count': 0}
+
+        def connect():
+            attempts['count'] += 1
+            if attempts['count'] <= 1:
+                raise IOError('database unavailable')
+            return sqlite3.connect(self.__db_path)
+
+        event_ring = telemetry.EventRing(capacity=8)
+        for page in ['page_1', 'page_2', 'page_3']:
+            event_ring.put('test_ip', 'test_agent', page, '')
+        event_ring.close()
+
+        telemetry.run_worker_logic(
+            event_ring,
+            connect,
+            0,
+            0,
+            True,
+            spool_dir=self.__spool_dir,
+            batch_size=1
+        )
+
+        db_connection = sqlite3.connect(self.__db_path)
+        cursor = db_connection.cursor()
+        cursor.execute('SELECT page FROM actions')
+        pages = list(map(lambda x: x[0], cursor.fetchall()))
+        db_connection.close()
+
+        self.assertEquals(pages, ['page_1', 'page_2', 'page_3'])
+        self.assertEquals(len(list_segments(self.__spool_dir)), 0)
+
+    def test_worker_stats(self):
+        def connect():
+            raise IOError('database unavailable')
+
+        event_ring = telemetry.EventRing(capacity=8)
+        event_ring.put('test_ip', 'test_agent', 'page_1', '')
+        event_ring.close()
+
+        worker_stats = [0] * telemetry.NUM_STATS
+        telemetry.run_worker_logic(
+            event_ring,
+            connect,
+            0,
+            0,
+            True,
+            spool_dir=self.__spool_dir,
+            worker_stats=worker_stats
+        )
+
+        self.assertEquals(worker_stats[telemetry.SPOOL_PENDING_STAT], 1)
+        self.assertEquals(worker_stats[telemetry.DISCARDED_STAT], 0)
+
+    def test_aggregate(self):
+        event_ring = telemetry.EventRing(capacity=8)
+        for i in range(5):
+            event_ring.put('test_ip', 'test_agent', 'query', 'Climate change')
+        event_ring.close()
+
+        telemetry.run_worker_logic(
+            event_ring,
+            lambda: sqlite3.connect(self.__db_path),
+            0,
+            0,
+            True,
+            aggregate=True
+        )
+
+        db_connection = sqlite3.connect(self.__db_path)
+        cursor = db_connection.cursor()
+        cursor.execute('SELECT query, SUM(actionCount) FROM actionRollups GROUP BY query')
+        rollups = list(cursor.fetchall())
+        cursor.execute('SELECT * FROM actions')
+        actions = list(cursor.fetchall())
+        db_connection.close()
+
+        self.assertEquals(rollups, [('change climate', 5)])
+        self.assertEquals(len(actions), 0)
+
+    def test_replay_truncated_segment(self):
+        os.makedirs(self.__spool_dir)
+        segment_path = os.path.join(self.__spool_dir, 'segment_0000000000000000.jsonl')
+        with open(segment_path, 'wb') as f:
+            f.write(b'["action", "hash", "test_agent", "page_0", "", "time"]\n')
+            f.write(b'["action", "hash", "test_ag')
+
+        event_ring = telemetry.EventRing(capacity=8)
+        event_ring.put('test_ip', 'test_agent', 'page_1', '')
+        event_ring.close()
+
+        telemetry.run_worker_logic(
+            event_ring,
+            lambda: sqlite3.connect(self.__db_path),
+            0,
+            0,
+            True,
+            spool_dir=self.__spool_dir
+        )
+
+        db_connection = sqlite3.connect(self.__db_path)
+        cursor = db_connection.cursor()
+        cursor.execute('SELECT page FROM actions')
+        pages = list(map(lambda x: x[0], cursor.fetchall()))
+        db_connection.close()
+
+        self.assertEquals(pages, ['page_0', 'page_1'])
+        self.assertEquals(len(list_segments(self.__spool_dir)), 0)
+
+    def test_replay_legacy_rows(self):
+        spool = telemetry.TelemetrySpool(self.__spool_dir)
+        spool.append(('hash', 'test_agent', 'page_0', '', 'time'))
+        spool.append(('action', 'hash', 'test_agent', 'page_1', '', 'time'))
+        spool.close()
+
+        event_ring = telemetry.EventRing(capacity=8)
+        event_ring.close()
+
+        telemetry.run_worker_logic(
+            event_ring,
+            lambda: sqlite3.connect(self.__db_path),
+            0,
+            0,
+            True,
+            spool_dir=self.__spool_dir
+        )
+
+        db_connection = sqlite3.connect(self.__db_path)
+        cursor = db_connection.cursor()
+        cursor.execute('SELECT page FROM actions')
+        pages = list(map(lambda x: x[0], cursor.fetchall()))
+        db_connection.close()
+
+        self.assertEquals(pages, ['page_0', 'page_1'])
+
+    def test_spool_write_failure(self):
+        def connect():
+            raise IOError('database unavailable')
+
+        def fail_append(self, row):
+            raise OSError('disk full')
+
+        event_ring = telemetry.EventRing(capacity=8)
+        event_ring.put('test_ip', 'test_agent', 'page_1', '')
+        event_ring.put('test_ip', 'test_agent', 'page_2', '')
+        event_ring.close()
+
+        worker_stats = [0] * telemetry.NUM_STATS
+        with unittest.mock.patch.object(telemetry.TelemetrySpool, 'append', fail_append):
+            telemetry.run_worker_logic(
+                event_ring,
+                connect,
+                0,
+                0,
+                True,
+                spool_dir=self.__spool_dir,
+                worker_stats=worker_stats
+            )
+
+        self.assertEquals(worker_stats[telemetry.DISCARDED_STAT], 2)